@@ -0,0 +1 @@
+Add ``qupulse.hardware.util.AffineVoltageTransformation`` for linear gain/offset voltage transformations. ``ProgramEntry`` based drivers fold it into the channel amplitude and offset instead of calling it on every sampled waveform. It is the new default ``PlaybackChannel.voltage_transformation``.
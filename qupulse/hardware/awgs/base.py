@@ -9,10 +9,13 @@ Classes:
 
 from abc import abstractmethod
 from numbers import Real
-from typing import Set, Tuple, Callable, Optional, Mapping, Sequence, List
-from collections import OrderedDict
+from typing import Set, Tuple, Callable, Optional, Mapping, Sequence, Iterator
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import weakref
 
-from qupulse.hardware.util import get_sample_times, not_none_indices
+from qupulse.hardware.util import get_segment_lengths, normalize_samples, AffineVoltageTransformation
 from qupulse.utils.types import ChannelID
 from qupulse.program.loop import Loop
 from qupulse.program.waveforms import Waveform
@@ -162,9 +165,173 @@ class ProgramOverwriteException(Exception):
                " Use force to overwrite.".format(self.name)
 
 
+class _SampledWaveformKey:
+    """Dictionary key that computes the hash once because hashing a waveform evaluates its whole compare_key."""
+    __slots__ = ('_key', '_hash')
+
+    def __init__(self, key: tuple):
+        self._key = key
+        self._hash = hash(key)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return self._key == other._key
+
+
+class _SampledWaveformCache:
+    """Bounded LRU cache of unprocessed waveform samples. It is not used by default because the lookup and the copy of
+    each sampled channel make one-shot uploads slower. A driver can opt in by setting the _sample_cache class attribute
+    of its ProgramEntry subclass if it repeatedly uploads programs that share waveforms.
+
+    The waveform itself is part of the key because waveforms do not support weak references which makes their id an
+    unsafe surrogate. Equal waveforms sample identically so they can share an entry. This means that the cache keeps
+    references to up to max_samples worth of waveforms alive."""
+
+    def __init__(self, max_samples: int):
+        self._max_samples = max_samples
+        self._n_samples = 0
+        # key -> (samples, number of samples) with samples being a dict (channel, dtype) -> read-only array
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._n_samples = 0
+
+    def lookup(self, waveform: Waveform,
+               sample_rate: TimeType) -> Tuple[_SampledWaveformKey, Optional[Mapping[tuple, numpy.ndarray]]]:
+        """Returns the key to use with store and the cached samples of the waveform or None. The waveform is only
+        hashed here."""
+        key = _SampledWaveformKey((waveform, sample_rate))
+        with self._lock:
+            entry = self._data.get(key, None)
+            if entry is None:
+                return key, None
+            self._data.move_to_end(key)
+        return key, entry[0]
+
+    def store(self, key: _SampledWaveformKey, samples: Mapping[tuple, numpy.ndarray]):
+        """Add samples to the entry of key. The caller must not modify the arrays afterwards."""
+        n_samples = sum(array.size for array in samples.values())
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                # entries are never modified so lookup results stay consistent without holding the lock
+                old_samples, old_n_samples = old
+                self._n_samples -= old_n_samples
+                samples = {**old_samples, **samples}
+                n_samples = sum(array.size for array in samples.values())
+            if n_samples > self._max_samples:
+                return
+            self._data[key] = (samples, n_samples)
+            self._n_samples += n_samples
+            while self._n_samples > self._max_samples:
+                _, (_, evicted_n_samples) = self._data.popitem(last=False)
+                self._n_samples -= evicted_n_samples
+
+
+class _ScratchMemoryPool:
+    """Small thread safe free list of one dimensional float arrays that are used as temporary sample memory. Arrays
+    that are larger than requested are handed out as well so the caller needs to slice. Arrays with more than
+    max_size elements are not kept which bounds the retained memory to max_arrays * max_size elements."""
+
+    def __init__(self, max_arrays: int, max_size: int):
+        self._max_arrays = max_arrays
+        self._max_size = max_size
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self, size: int) -> numpy.ndarray:
+        with self._lock:
+            # best fit so small requests do not take the large arrays
+            best = None
+            for idx, array in enumerate(self._free):
+                if array.size >= size and (best is None or array.size < self._free[best].size):
+                    best = idx
+            if best is not None:
+                return self._free.pop(best)
+        return numpy.empty(size, dtype=float)
+
+    def release(self, array: numpy.ndarray):
+        if array.size > self._max_size:
+            return
+        with self._lock:
+            if len(self._free) < self._max_arrays:
+                self._free.append(array)
+            elif self._free:
+                # keep the larger arrays as they can serve more requests
+                smallest = min(range(len(self._free)), key=lambda idx: self._free[idx].size)
+                if self._free[smallest].size < array.size:
+                    self._free[smallest] = array
+
+
+# float64 -> at most 4 MiB
+_SCRATCH_POOL = _ScratchMemoryPool(max_arrays=8, max_size=2 ** 16)
+
+
+# Sample time arrays of this many samples are shared for the most recently used sample rates. Longer waveforms get
+# their own time array because its creation is negligible compared to sampling. This bounds the memory to 2 MiB.
+_TIME_ARRAY_CACHE_SIZE = 2 ** 16
+_TIME_ARRAY_CACHE_MAX_RATES = 4
+_TIME_ARRAY_CACHE = OrderedDict()
+_TIME_ARRAY_CACHE_LOCK = threading.Lock()
+
+
+def _get_sample_times(waveforms: Sequence[Waveform], sample_rate: TimeType) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Same as qupulse.hardware.util.get_sample_times but short time arrays are read-only views into a buffer that is
+    shared by all ProgramEntry instances with the same sample rate."""
+    segment_lengths = get_segment_lengths(waveforms, sample_rate)
+    n_max = int(numpy.max(segment_lengths))
+    if n_max > _TIME_ARRAY_CACHE_SIZE:
+        return numpy.arange(n_max, dtype=float) / float(sample_rate), segment_lengths
+
+    with _TIME_ARRAY_CACHE_LOCK:
+        time_array = _TIME_ARRAY_CACHE.get(sample_rate, None)
+        if time_array is None:
+            time_array = numpy.arange(_TIME_ARRAY_CACHE_SIZE, dtype=float) / float(sample_rate)
+            time_array.flags.writeable = False
+            _TIME_ARRAY_CACHE[sample_rate] = time_array
+            while len(_TIME_ARRAY_CACHE) > _TIME_ARRAY_CACHE_MAX_RATES:
+                _TIME_ARRAY_CACHE.popitem(last=False)
+        else:
+            _TIME_ARRAY_CACHE.move_to_end(sample_rate)
+    return time_array[:n_max], segment_lengths
+
+
+def _is_partitioned_by(array: numpy.ndarray, parts: Sequence[numpy.ndarray]) -> bool:
+    """True if parts are consecutive views into the one dimensional array that cover it exactly."""
+    address = array.__array_interface__['data'][0]
+    for part in parts:
+        if part.base is not array.base or part.strides != array.strides \
+                or part.__array_interface__['data'][0] != address:
+            return False
+        address += part.nbytes
+    return address == array.__array_interface__['data'][0] + array.nbytes
+
+
 class ProgramEntry:
     """This is a helper class for implementing awgs drivers. A driver can subclass it to help organizing sampled
     waveforms"""
+
+    __slots__ = ('_channels', '_markers', '_amplitudes', '_offsets', '_voltage_transformations',
+                 '_channel_offsets', '_channel_inv_amplitudes', '_active_channels', '_active_markers',
+                 '_shared_trafo_inputs', '_sample_rate', '_loop', '_pending_waveforms', '_sampled_waveforms', '_last_sample_memory')
+
+    # dtype of the normalized channel data. Drivers for AWGs with a DAC resolution of 16 bit or less can use
+    # numpy.float32 to halve the memory footprint of the sampled waveforms
+    _sample_dtype = float
+
+    # number of threads used by _sample_waveforms. None samples in the calling thread. Threads only help if the
+    # waveforms release the GIL for most of the sampling time
+    _sample_workers = None
+
+    # optional _SampledWaveformCache that is shared by all instances of the class. Only worth it if the same waveforms
+    # are uploaded repeatedly
+    _sample_cache = None
+
     def __init__(self, loop: Loop,
                  channels: Tuple[Optional[ChannelID], ...],
                  markers: Tuple[Optional[ChannelID], ...],
@@ -183,8 +350,8 @@ class ProgramEntry:
             offsets:
             voltage_transformations:
             sample_rate:
-            waveforms: These waveforms are sampled and stored in _waveforms. If None the waveforms are extracted from
-            loop
+            waveforms: These waveforms are sampled on first access and stored in _waveforms. If None the waveforms are
+            extracted from loop
         """
         assert len(channels) == len(amplitudes) == len(offsets) == len(voltage_transformations)
 
@@ -194,17 +361,122 @@ class ProgramEntry:
         self._offsets = tuple(offsets)
         self._voltage_transformations = tuple(voltage_transformations)
 
+        # (slot, channel, trafo, offset, inv_amplitude) of the used channels
+        active_channels = []
+        for slot, (channel, trafo, offset, amplitude) in enumerate(zip(self._channels,
+                                                                       self._voltage_transformations,
+                                                                       self._offsets, self._amplitudes)):
+            if channel is None:
+                # unused slots are never normalized so their amplitude is irrelevant
+                continue
+            if amplitude == 0:
+                raise ValueError('Amplitude of channel slot {} with channel {!r} is zero'.format(slot, channel))
+            inv_amplitude = 1. / amplitude
+            if isinstance(trafo, AffineVoltageTransformation) and trafo.scale != 0:
+                # (scale * x + trafo.offset - offset) * inv_amplitude
+                #   == (x - (offset - trafo.offset) / scale) * (scale * inv_amplitude)
+                offset = (offset - trafo.offset) / trafo.scale
+                inv_amplitude = inv_amplitude * trafo.scale
+                trafo = None
+            active_channels.append((slot, channel, trafo, offset, inv_amplitude))
+        # channels without transformation are sampled first so their raw samples can be reused by the other slots
+        active_channels.sort(key=lambda record: record[2] is not None)
+
+        # (slot, channel, trafo) of the used channels and (slot, marker) of the used markers. The position in these
+        # tuples is the row in the channel/marker memory
+        self._active_channels = tuple((slot, channel, trafo) for slot, channel, trafo, *_ in active_channels)
+        self._active_markers = tuple((slot, marker) for slot, marker in enumerate(self._markers) if marker is not None)
+        # offsets and inverse amplitudes of the used channels in channel memory order as column vectors to normalize
+        # all channels of a waveform segment with a single broadcasted operation
+        self._channel_offsets = numpy.array([offset for *_, offset, _ in active_channels],
+                                            dtype=self._sample_dtype).reshape(-1, 1)
+        self._channel_inv_amplitudes = numpy.array([inv_amplitude for *_, inv_amplitude in active_channels],
+                                                   dtype=self._sample_dtype).reshape(-1, 1)
+
+        # channels that are only used with a transformation but in more than one channel or marker slot. Their raw
+        # samples need separate memory because they can not be kept in a final row
+        raw_channels = {channel for _, channel, trafo in self._active_channels if trafo is None}
+        trafo_inputs = [channel for _, channel, trafo in self._active_channels if trafo is not None]
+        usages = Counter(trafo_inputs)
+        usages.update(set(self._markers) & set(trafo_inputs))
+        self._shared_trafo_inputs = frozenset(channel for channel, n_usages in usages.items()
+                                              if n_usages > 1 and channel not in raw_channels)
+
         self._sample_rate = sample_rate
 
         self._loop = loop
 
         if waveforms is None:
-            waveforms = OrderedDict((node.waveform, None)
-                                    for node in loop.get_depth_first_iterator() if node.is_leaf()).keys()
-        if waveforms:
-            self._waveforms = OrderedDict(zip(waveforms, self._sample_waveforms(waveforms)))
-        else:
-            self._waveforms = OrderedDict()
+            waveforms = list(dict.fromkeys(node.waveform
+                                           for node in loop.get_depth_first_iterator() if node.is_leaf()))
+        # sampling is deferred until the waveforms are accessed
+        self._pending_waveforms = dict.fromkeys(waveforms)
+        self._sampled_waveforms = OrderedDict()
+        # (waveforms, channel memory ref, marker memory ref) of the last _sample_waveforms call. Weak references
+        # because subclasses may replace the sampled data in _waveforms
+        self._last_sample_memory = None
+
+    @property
+    def _waveforms(self) -> 'OrderedDict[Waveform, Tuple[Tuple[numpy.ndarray, ...], Tuple[numpy.ndarray, ...]]]':
+        """Sampled channels and markers of all waveforms. The waveforms that were not sampled via sampled_waveform
+        are sampled together on the first access."""
+        if self._pending_waveforms:
+            pending = self._pending_waveforms
+            sampled = self._sampled_waveforms
+            missing = [waveform for waveform in pending if waveform not in sampled]
+            newly_sampled = dict(zip(missing, self._sample_waveforms(missing))) if missing else {}
+            # only reached if sampling succeeded. Otherwise the waveforms stay pending and the next access raises again
+            self._sampled_waveforms = OrderedDict(
+                (waveform, sampled[waveform] if waveform in sampled else newly_sampled[waveform])
+                for waveform in pending
+            )
+            self._pending_waveforms = {}
+        return self._sampled_waveforms
+
+    def sampled_waveform(self, waveform: Waveform) -> Tuple[Tuple[numpy.ndarray, ...], Tuple[numpy.ndarray, ...]]:
+        """Sampled channels and markers of a single waveform. Only this waveform is sampled if the others were not
+        accessed yet.
+
+        Raises:
+            KeyError if the waveform does not belong to this entry
+        """
+        try:
+            return self._sampled_waveforms[waveform]
+        except KeyError:
+            if waveform not in self._pending_waveforms:
+                raise
+        result, = self._sample_waveforms([waveform])
+        self._sampled_waveforms[waveform] = result
+        return result
+
+    def channel_samples(self, slot: int) -> Optional[numpy.ndarray]:
+        """Samples of a channel slot for all waveforms concatenated in the order of _waveforms. This is a view into the
+        channel memory if the waveforms were sampled together and a copy otherwise. None if there are no waveforms or
+        for empty slots if _sample_empty_channel returns None."""
+        return self._concatenated_samples(slot, 0, self._active_channels)
+
+    def marker_samples(self, slot: int) -> Optional[numpy.ndarray]:
+        """Same as channel_samples for marker slots."""
+        return self._concatenated_samples(slot, 1, self._active_markers)
+
+    def _concatenated_samples(self, slot: int, kind: int, active: Tuple[tuple, ...]) -> Optional[numpy.ndarray]:
+        waveforms = self._waveforms
+        samples = [sampled[kind][slot] for sampled in waveforms.values()]
+        if not samples or any(sample is None for sample in samples):
+            return None
+
+        rows = [row for row, (active_slot, *_) in enumerate(active) if active_slot == slot]
+        if rows and self._last_sample_memory is not None:
+            sampled_waveforms, *memory_refs = self._last_sample_memory
+            memory = memory_refs[kind]()
+            if memory is not None and len(sampled_waveforms) == len(waveforms) \
+                    and all(a is b for a, b in zip(sampled_waveforms, waveforms)):
+                row = memory[rows[0]]
+                # subclasses may have replaced some of the sampled data
+                if _is_partitioned_by(row, samples):
+                    return row
+
+        return numpy.concatenate(samples)
 
     def _sample_empty_channel(self, time: numpy.ndarray) -> Optional[numpy.ndarray]:
         """Override this in derived class to change how empty channels are handled"""
@@ -214,70 +486,148 @@ class ProgramEntry:
         """Override this in derived class to change how empty channels are handled"""
         return None
 
-    def _sample_waveforms(self, waveforms: Sequence[Waveform]) -> List[Tuple[Tuple[numpy.ndarray, ...],
-                                                                             Tuple[numpy.ndarray, ...]]]:
-        sampled_waveforms = []
-
-        time_array, segment_lengths = get_sample_times(waveforms, self._sample_rate)
-        sample_memory = numpy.zeros_like(time_array, dtype=float)
+    def _sample_waveforms(self, waveforms: Sequence[Waveform]) -> Iterator[Tuple[Tuple[numpy.ndarray, ...],
+                                                                                 Tuple[numpy.ndarray, ...]]]:
+        """Lazily yields the sampled channels and markers of each waveform. The returned arrays are views into one
+        buffer per kind that is allocated up front."""
+        time_array, segment_lengths = _get_sample_times(waveforms, self._sample_rate)
 
         n_samples = numpy.sum(segment_lengths)
-        ch_to_mem, n_ch = not_none_indices(self._channels)
-        mk_to_mem, c_mk = not_none_indices(self._markers)
 
-        ch_memory = numpy.zeros((n_ch, n_samples), dtype=float)
-        marker_memory = numpy.zeros((c_mk, n_samples), dtype=bool)
-        segment_begin = 0
+        # every element of these buffers is written before it is read so there is no need to zero them
+        ch_memory = numpy.empty((len(self._active_channels), n_samples), dtype=self._sample_dtype)
+        marker_memory = numpy.empty((len(self._active_markers), n_samples), dtype=bool)
+        self._last_sample_memory = (tuple(waveforms), weakref.ref(ch_memory), weakref.ref(marker_memory))
 
+        segments = []
+        segment_begin = 0
         for waveform, segment_length in zip(waveforms, segment_lengths):
             segment_length = int(segment_length)
             segment_end = segment_begin + segment_length
+            segments.append((waveform, time_array[:segment_length],
+                             ch_memory[:, segment_begin:segment_end], marker_memory[:, segment_begin:segment_end]))
+            segment_begin = segment_end
+        assert segment_begin == n_samples
 
-            wf_time = time_array[:segment_length]
-            wf_sample_memory = sample_memory[:segment_length]
+        def sample_segment(waveform, wf_time, ch_block, mk_block):
+            sample_memory = _SCRATCH_POOL.acquire(len(wf_time))
+            try:
+                return self._sample_one(waveform, wf_time, ch_block, mk_block,
+                                        sample_memory=sample_memory[:len(wf_time)])
+            finally:
+                _SCRATCH_POOL.release(sample_memory)
+
+        if self._sample_workers is None:
+            sample_memory = _SCRATCH_POOL.acquire(len(time_array))
+            try:
+                for waveform, wf_time, ch_block, mk_block in segments:
+                    yield self._sample_one(waveform, wf_time, ch_block, mk_block,
+                                           sample_memory=sample_memory[:len(wf_time)])
+            finally:
+                _SCRATCH_POOL.release(sample_memory)
+        else:
+            with ThreadPoolExecutor(max_workers=self._sample_workers) as executor:
+                yield from executor.map(lambda segment: sample_segment(*segment), segments)
+
+    def _sample_one(self, waveform: Waveform, wf_time: numpy.ndarray,
+                    ch_block: numpy.ndarray, mk_block: numpy.ndarray,
+                    sample_memory: numpy.ndarray = None) -> Tuple[Tuple[numpy.ndarray, ...],
+                                                                  Tuple[numpy.ndarray, ...]]:
+        """Sample a single waveform into its segment of the channel and marker memory.
 
-            sampled_channels = []
-            for channel, ch_mem_pos, trafo, amplitude, offset in zip(self._channels, ch_to_mem,
-                                                                     self._voltage_transformations,
-                                                                     self._amplitudes, self._offsets):
-                final_memory = ch_memory[ch_mem_pos, segment_begin:segment_end]
+        Args:
+            waveform: Waveform to sample
+            wf_time: Sample times of the waveform
+            ch_block: Segment of the channel memory of shape (n_channels, len(wf_time))
+            mk_block: Segment of the marker memory of shape (n_markers, len(wf_time))
+            sample_memory: Scratch memory of the same shape as wf_time. Allocated if None.
+        """
+        if sample_memory is None:
+            sample_memory = numpy.empty_like(wf_time, dtype=float)
 
-                if channel is None:
-                    sampled_channels.append(self._sample_empty_channel(wf_time))
+        sample_cache = self._sample_cache
+        if sample_cache is None:
+            cache_key = cached_samples = new_samples = None
+        else:
+            cache_key, cached_samples = sample_cache.lookup(waveform, self._sample_rate)
+            new_samples = {}
+
+        def get_sampled(channel: ChannelID, output_array: numpy.ndarray) -> numpy.ndarray:
+            samples_key = (channel, output_array.dtype)
+            if cached_samples is not None:
+                cached = cached_samples.get(samples_key, None)
+                if cached is not None:
+                    output_array[:] = cached
+                    return output_array
+            sampled = waveform.get_sampled(channel, wf_time, output_array=output_array)
+            if new_samples is not None:
+                # copy before the output array is normalized or reused
+                cached = sampled.copy()
+                cached.flags.writeable = False
+                new_samples[samples_key] = cached
+            return sampled
+
+        # raw samples of this segment that stay valid until the normalization. Used to sample channels that are
+        # used in multiple slots only once
+        raw_samples = {}
+
+        sampled_channels = [None] * len(self._channels)
+        for slot, channel in enumerate(self._channels):
+            if channel is None:
+                sampled_channels[slot] = self._sample_empty_channel(wf_time)
+
+        for (slot, channel, trafo), final_memory in zip(self._active_channels, ch_block):
+            raw = raw_samples.get(channel, None)
+            if trafo is None:
+                if raw is None:
+                    # sample directly into the final memory
+                    sampled = get_sampled(channel, output_array=final_memory)
+                    raw_samples[channel] = sampled
                 else:
-                    if trafo is None:
-                        # sample directly into the final memory
-                        sampled = waveform.get_sampled(channel, wf_time, output_array=final_memory)
+                    final_memory[:] = raw
+                    sampled = final_memory
+            else:
+                if raw is None:
+                    if channel in self._shared_trafo_inputs:
+                        # keep the raw samples for the other slots that use this channel
+                        raw = get_sampled(channel, output_array=numpy.empty_like(sample_memory))
+                        raw_samples[channel] = raw
                     else:
                         # sample into temporary memory and write the trafo result in the final memory
-                        # unfortunately trafo will always allocate :(
-                        sampled = waveform.get_sampled(channel, wf_time, output_array=wf_sample_memory)
-                        assert sampled is wf_sample_memory
-                        final_memory[:] = trafo(sampled)
-                        sampled = final_memory
-                    assert sampled is final_memory
-                    sampled -= offset
-                    sampled /= amplitude
-                    sampled_channels.append(sampled)
-
-            sampled_markers = []
-            for marker, mk_mem_pos in zip(self._markers, mk_to_mem):
-                final_memory = marker_memory[mk_mem_pos, segment_begin:segment_end]
-
-                if marker is None:
-                    sampled_markers.append(self._sample_empty_marker(wf_time))
-                else:
-                    sampled = waveform.get_sampled(marker, wf_time, output_array=wf_sample_memory)
-                    sampled = numpy.not_equal(sampled, 0., out=final_memory)
-                    assert sampled is final_memory
-
-                    sampled_markers.append(sampled)
-
-            sampled_waveforms.append((tuple(sampled_channels), tuple(sampled_markers)))
-
-            segment_begin = segment_end
-        assert segment_begin == n_samples
-        return sampled_waveforms
+                        raw = get_sampled(channel, output_array=sample_memory)
+                        assert raw is sample_memory
+                # unfortunately trafo will always allocate :(
+                final_memory[:] = trafo(raw)
+                sampled = final_memory
+            assert sampled is final_memory
+            sampled_channels[slot] = sampled
+
+        sampled_markers = [None] * len(self._markers)
+        for slot, marker in enumerate(self._markers):
+            if marker is None:
+                sampled_markers[slot] = self._sample_empty_marker(wf_time)
+
+        marker_samples = {}
+        for (slot, marker), final_memory in zip(self._active_markers, mk_block):
+            if marker in marker_samples:
+                final_memory[:] = marker_samples[marker]
+                sampled = final_memory
+            else:
+                raw = raw_samples.get(marker, None)
+                if raw is None:
+                    raw = get_sampled(marker, output_array=sample_memory)
+                sampled = numpy.not_equal(raw, 0., out=final_memory)
+                marker_samples[marker] = sampled
+            assert sampled is final_memory
+            sampled_markers[slot] = sampled
+
+        if new_samples:
+            sample_cache.store(cache_key, new_samples)
+
+        # normalize all channels of this segment at once
+        normalize_samples(ch_block, self._channel_offsets, self._channel_inv_amplitudes)
+
+        return tuple(sampled_channels), tuple(sampled_markers)
 
 
 class OutOfWaveformMemoryException(Exception):
@@ -5,6 +5,7 @@ import numbers
 
 from qupulse.hardware.awgs.base import AWG
 from qupulse.hardware.dacs import DAC
+from qupulse.hardware.util import AffineVoltageTransformation
 from qupulse.program.loop import Loop
 
 from qupulse.utils.types import ChannelID
@@ -49,7 +50,7 @@ class _SingleChannel:
 class PlaybackChannel(_SingleChannel):
     """A hardware channel that is not a marker"""
     def __init__(self, awg: AWG, channel_on_awg: int,
-                 voltage_transformation: Callable[[np.ndarray], np.ndarray]=lambda x: x):
+                 voltage_transformation: Callable[[np.ndarray], np.ndarray]=AffineVoltageTransformation()):
         if channel_on_awg >= awg.num_channels:
             raise ValueError('Can not create PlayBack channel {}. AWG only has {} channels'.format(channel_on_awg,
                                                                                                    awg.num_channels))
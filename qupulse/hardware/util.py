@@ -26,7 +26,43 @@ try:
 except ImportError:  # pragma: no cover
     zhinst = None
 
-__all__ = ['voltage_to_uint16', 'get_sample_times', 'traced', 'zhinst_voltage_to_uint16']
+__all__ = ['voltage_to_uint16', 'get_sample_times', 'traced', 'zhinst_voltage_to_uint16', 'AffineVoltageTransformation']
+
+
+class AffineVoltageTransformation:
+    """Voltage transformation scale * voltage + offset. Use this instead of an equivalent function for gain/offset
+    calibrations: Drivers based on ProgramEntry fold it into the channel's amplitude and offset instead of calling it
+    on each sampled waveform."""
+    __slots__ = ('_scale', '_offset')
+
+    def __init__(self, scale: float = 1., offset: float = 0.):
+        self._scale = scale
+        self._offset = offset
+
+    @property
+    def scale(self) -> float:
+        return self._scale
+
+    @property
+    def offset(self) -> float:
+        return self._offset
+
+    def __call__(self, voltage: np.ndarray) -> np.ndarray:
+        if self._scale == 1 and self._offset == 0:
+            # behave like the previous default lambda x: x for drivers that call the transformation directly
+            return voltage
+        return voltage * self._scale + self._offset
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return (self._scale, self._offset) == (other._scale, other._offset)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self._scale, self._offset))
+
+    def __repr__(self):
+        return '{}(scale={!r}, offset={!r})'.format(type(self).__name__, self._scale, self._offset)
 
 
 @njit
@@ -96,6 +132,40 @@ def voltage_to_uint16(voltage: np.ndarray, output_amplitude: float, output_offse
                                                       output_amplitude=output_amplitude)) from err
 
 
+@njit
+def _normalize_samples_numba(samples: np.ndarray, offsets: np.ndarray, inv_amplitudes: np.ndarray):
+    """Implementation detail that can be compiled with numba. Subtraction and scaling are fused into one pass."""
+    for i in range(samples.shape[0]):
+        offset = offsets[i, 0]
+        inv_amplitude = inv_amplitudes[i, 0]
+        for j in range(samples.shape[1]):
+            samples[i, j] = (samples[i, j] - offset) * inv_amplitude
+
+
+def _normalize_samples_numpy(samples: np.ndarray, offsets: np.ndarray, inv_amplitudes: np.ndarray):
+    """Implementation detail to be used if numba is not available."""
+    samples -= offsets
+    samples *= inv_amplitudes
+
+
+def normalize_samples(samples: np.ndarray, offsets: np.ndarray, inv_amplitudes: np.ndarray) -> np.ndarray:
+    """Calculate (samples - offsets) * inv_amplitudes in place.
+
+    Args:
+        samples: Float array of shape (n_channels, n_samples). Is modified.
+        offsets: Float array of shape (n_channels, 1)
+        inv_amplitudes: Float array of shape (n_channels, 1)
+
+    Returns:
+        samples
+    """
+    if numba:
+        _normalize_samples_numba(samples, offsets, inv_amplitudes)
+    else:
+        _normalize_samples_numpy(samples, offsets, inv_amplitudes)
+    return samples
+
+
 def find_positions(data: Sequence, to_find: Sequence) -> np.ndarray:
     """Find indices of the first occurrence of the elements of to_find in data. Elements that are not in data result in
     -1"""
@@ -172,6 +242,15 @@ def get_sample_times(waveforms: Union[Collection[Waveform], Waveform],
         sample_times, n_samples = get_sample_times([waveforms], sample_rate_in_GHz)
         return sample_times, n_samples.squeeze()
 
+    segment_lengths = get_segment_lengths(waveforms, sample_rate_in_GHz, tolerance=tolerance)
+    time_array = np.arange(np.max(segment_lengths), dtype=float) / float(sample_rate_in_GHz)
+
+    return time_array, segment_lengths
+
+
+def get_segment_lengths(waveforms: Collection[Waveform],
+                        sample_rate_in_GHz: TimeType, tolerance: float = 1e-10) -> np.ndarray:
+    """Number of samples of each waveform as uint64 array. See get_sample_times for the raised exceptions."""
     assert len(waveforms) > 0, "An empty waveform list is not allowed"
 
     segment_lengths = []
@@ -179,10 +258,7 @@ def get_sample_times(waveforms: Union[Collection[Waveform], Waveform],
         rounded_segment_length = get_waveform_length(waveform, sample_rate_in_GHz=sample_rate_in_GHz, tolerance=tolerance)
         segment_lengths.append(rounded_segment_length)
 
-    segment_lengths = np.asarray(segment_lengths, dtype=np.uint64)
-    time_array = np.arange(np.max(segment_lengths), dtype=float) / float(sample_rate_in_GHz)
-
-    return time_array, segment_lengths
+    return np.asarray(segment_lengths, dtype=np.uint64)
 
 
 @njit
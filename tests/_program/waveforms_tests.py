@@ -17,6 +17,16 @@ from tests.pulses.sequencing_dummies import DummyWaveform, DummyInterpolationStr
 from tests._program.transformation_tests import TransformationStub
 
 
+# inputs of MultiChannelWaveformTest.test_unsafe_sample. Only _REUSE_BUF is written to
+_SAMPLE_TIMES = numpy.linspace(98.5, 103.5, num=11)
+_SAMPLES_A = numpy.linspace(4, 5, 11)
+_SAMPLES_B = numpy.linspace(2, 3, 11)
+for _arr in (_SAMPLE_TIMES, _SAMPLES_A, _SAMPLES_B):
+    _arr.setflags(write=False)
+del _arr
+_REUSE_BUF = numpy.empty(11, dtype=_SAMPLES_A.dtype)
+
+
 def assert_constant_consistent(test_case: unittest.TestCase, wf: Waveform):
     if wf.is_constant():
         cvs = wf.constant_value_dict()
@@ -149,6 +159,16 @@ class WaveformTest(unittest.TestCase):
 
 
 class MultiChannelWaveformTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        # these dummies are never sampled so they can be shared between tests
+        cls.dwf_a = DummyWaveform(duration=2.2, defined_channels={'A'})
+        cls.dwf_b = DummyWaveform(duration=2.2, defined_channels={'B'})
+        cls.dwf_c = DummyWaveform(duration=2.2, defined_channels={'C'})
+        cls.wf_a1 = MultiChannelWaveform([cls.dwf_a, cls.dwf_b])
+        cls.wf_a2 = MultiChannelWaveform([cls.dwf_a, cls.dwf_b])
+        cls.wf_a3 = MultiChannelWaveform([cls.dwf_a, cls.dwf_c])
+
     def test_init_no_args(self) -> None:
         with self.assertRaises(ValueError):
             MultiChannelWaveform(dict())
@@ -156,9 +176,7 @@ class MultiChannelWaveformTest(unittest.TestCase):
             MultiChannelWaveform(None)
 
     def test_from_parallel(self):
-        dwf_a = DummyWaveform(duration=2.2, defined_channels={'A'})
-        dwf_b = DummyWaveform(duration=2.2, defined_channels={'B'})
-        dwf_c = DummyWaveform(duration=2.2, defined_channels={'C'})
+        dwf_a, dwf_b, dwf_c = self.dwf_a, self.dwf_b, self.dwf_c
 
         self.assertIs(dwf_a, MultiChannelWaveform.from_parallel([dwf_a]))
 
@@ -169,9 +187,7 @@ class MultiChannelWaveformTest(unittest.TestCase):
         self.assertEqual(wf_abc, MultiChannelWaveform([dwf_a, dwf_b, dwf_c]))
 
     def test_get_item(self):
-        dwf_a = DummyWaveform(duration=2.2, defined_channels={'A'})
-        dwf_b = DummyWaveform(duration=2.2, defined_channels={'B'})
-        dwf_c = DummyWaveform(duration=2.2, defined_channels={'C'})
+        dwf_a, dwf_b, dwf_c = self.dwf_a, self.dwf_b, self.dwf_c
 
         wf = MultiChannelWaveform([dwf_a, dwf_b, dwf_c])
 
@@ -190,8 +206,7 @@ class MultiChannelWaveformTest(unittest.TestCase):
         self.assertEqual(TimeType.from_float(1.3), waveform.duration)
 
     def test_init_several_channels(self) -> None:
-        dwf_a = DummyWaveform(duration=2.2, defined_channels={'A'})
-        dwf_b = DummyWaveform(duration=2.2, defined_channels={'B'})
+        dwf_a, dwf_b = self.dwf_a, self.dwf_b
         dwf_c = DummyWaveform(duration=2.3, defined_channels={'C'})
 
         waveform = MultiChannelWaveform([dwf_a, dwf_b])
@@ -205,29 +220,26 @@ class MultiChannelWaveformTest(unittest.TestCase):
         with self.assertRaises(ValueError):
             MultiChannelWaveform((dwf_a, dwf_a))
 
-        dwf_c_valid = DummyWaveform(duration=2.2, defined_channels={'C'})
-        waveform_flat = MultiChannelWaveform.from_parallel((waveform, dwf_c_valid))
+        waveform_flat = MultiChannelWaveform.from_parallel((waveform, self.dwf_c))
         self.assertEqual(len(waveform_flat.compare_key), 3)
 
     def test_unsafe_sample(self) -> None:
-        sample_times = numpy.linspace(98.5, 103.5, num=11)
-        samples_a = numpy.linspace(4, 5, 11)
-        samples_b = numpy.linspace(2, 3, 11)
+        sample_times, samples_a, samples_b = _SAMPLE_TIMES, _SAMPLES_A, _SAMPLES_B
         dwf_a = DummyWaveform(duration=3.2, sample_output=samples_a, defined_channels={'A'})
         dwf_b = DummyWaveform(duration=3.2, sample_output=samples_b, defined_channels={'B', 'C'})
         waveform = MultiChannelWaveform((dwf_a, dwf_b))
 
         result_a = waveform.unsafe_sample('A', sample_times)
-        numpy.testing.assert_equal(result_a, samples_a)
+        self.assertTrue(numpy.array_equal(result_a, samples_a))
 
         result_b = waveform.unsafe_sample('B', sample_times)
-        numpy.testing.assert_equal(result_b, samples_b)
+        self.assertTrue(numpy.array_equal(result_b, samples_b))
 
         self.assertEqual(len(dwf_a.sample_calls), 1)
         self.assertEqual(len(dwf_b.sample_calls), 1)
 
-        numpy.testing.assert_equal(sample_times, dwf_a.sample_calls[0][1])
-        numpy.testing.assert_equal(sample_times, dwf_b.sample_calls[0][1])
+        self.assertTrue(numpy.array_equal(sample_times, dwf_a.sample_calls[0][1]))
+        self.assertTrue(numpy.array_equal(sample_times, dwf_b.sample_calls[0][1]))
 
         self.assertEqual('A', dwf_a.sample_calls[0][0])
         self.assertEqual('B', dwf_b.sample_calls[0][0])
@@ -235,28 +247,27 @@ class MultiChannelWaveformTest(unittest.TestCase):
         self.assertIs(dwf_a.sample_calls[0][2], None)
         self.assertIs(dwf_b.sample_calls[0][2], None)
 
-        reuse_output = numpy.empty_like(samples_a)
+        reuse_output = _REUSE_BUF
+        reuse_output.fill(0)
         result_a = waveform.unsafe_sample('A', sample_times, reuse_output)
         self.assertEqual(len(dwf_a.sample_calls), 2)
         self.assertIs(result_a, reuse_output)
         self.assertIs(result_a, dwf_a.sample_calls[1][2])
-        numpy.testing.assert_equal(result_b, samples_b)
+        self.assertTrue(numpy.array_equal(result_b, samples_b))
 
     def test_equality(self) -> None:
-        dwf_a = DummyWaveform(duration=246.2, defined_channels={'A'})
-        dwf_b = DummyWaveform(duration=246.2, defined_channels={'B'})
-        dwf_c = DummyWaveform(duration=246.2, defined_channels={'C'})
-        waveform_a1 = MultiChannelWaveform([dwf_a, dwf_b])
-        waveform_a2 = MultiChannelWaveform([dwf_a, dwf_b])
-        waveform_a3 = MultiChannelWaveform([dwf_a, dwf_c])
-        self.assertEqual(waveform_a1, waveform_a1)
-        self.assertEqual(waveform_a1, waveform_a2)
-        self.assertNotEqual(waveform_a1, waveform_a3)
+        cases = [('a1 == a1', self.wf_a1, self.wf_a1, True),
+                 ('a1 == a2', self.wf_a1, self.wf_a2, True),
+                 ('a1 == a3', self.wf_a1, self.wf_a3, False)]
+        for msg, lhs, rhs, expected in cases:
+            with self.subTest(msg):
+                if expected:
+                    self.assertEqual(lhs, rhs)
+                else:
+                    self.assertNotEqual(lhs, rhs)
 
     def test_unsafe_get_subset_for_channels(self):
-        dwf_a = DummyWaveform(duration=246.2, defined_channels={'A'})
-        dwf_b = DummyWaveform(duration=246.2, defined_channels={'B'})
-        dwf_c = DummyWaveform(duration=246.2, defined_channels={'C'})
+        dwf_a, dwf_b, dwf_c = self.dwf_a, self.dwf_b, self.dwf_c
 
         mcwf = MultiChannelWaveform((dwf_a, dwf_b, dwf_c))
         with self.assertRaises(KeyError):
@@ -6,7 +6,9 @@ import numpy as np
 
 from qupulse.utils.types import TimeType
 from qupulse.program.loop import Loop
+from qupulse.hardware.awgs import base
 from qupulse.hardware.awgs.base import ProgramEntry
+from qupulse.hardware.util import get_sample_times, AffineVoltageTransformation
 
 from tests.pulses.sequencing_dummies import DummyWaveform
 
@@ -39,7 +41,7 @@ class ProgramEntryTests(unittest.TestCase):
 
     def test_init(self):
         sampled = [mock.Mock(), mock.Mock()]
-        expected_default = OrderedDict([(wf, None) for wf in self.waveforms]).keys()
+        expected_default = list(self.waveforms)
         expected_waveforms = OrderedDict(zip(self.waveforms, sampled))
 
         with mock.patch.object(ProgramEntry, '_sample_waveforms', return_value=sampled) as sample_waveforms:
@@ -52,6 +54,8 @@ class ProgramEntryTests(unittest.TestCase):
                                  sample_rate=self.sample_rate,
                                  waveforms=[])
             self.assertIs(self.loop, entry._loop)
+            np.testing.assert_equal(np.array([[0.], [.1]]), entry._channel_offsets)
+            np.testing.assert_equal(np.array([[1.], [2.]]), entry._channel_inv_amplitudes)
             self.assertEqual(0, len(entry._waveforms))
             sample_waveforms.assert_not_called()
 
@@ -79,6 +83,81 @@ class ProgramEntryTests(unittest.TestCase):
             self.assertEqual(OrderedDict([(self.waveforms[0], sampled[0])]), entry._waveforms)
             sample_waveforms.assert_called_once_with(self.waveforms[:1])
 
+    def test_init_zero_amplitude(self):
+        # unused slots may have a zero amplitude
+        entry = ProgramEntry(loop=self.loop,
+                             channels=self.channels,
+                             markers=self.marker,
+                             amplitudes=(1., 0., .5),
+                             offsets=self.offset,
+                             voltage_transformations=self.voltage_transformations,
+                             sample_rate=self.sample_rate,
+                             waveforms=[])
+        np.testing.assert_equal(np.array([[1.], [2.]]), entry._channel_inv_amplitudes)
+
+        with self.assertRaisesRegex(ValueError, 'slot 2'):
+            ProgramEntry(loop=self.loop,
+                         channels=self.channels,
+                         markers=self.marker,
+                         amplitudes=(1., 1., 0.),
+                         offsets=self.offset,
+                         voltage_transformations=self.voltage_transformations,
+                         sample_rate=self.sample_rate,
+                         waveforms=[])
+
+    def test_lazy_sampling(self):
+        sampled = [mock.Mock(), mock.Mock()]
+
+        def sample_waveforms_side_effect(waveforms):
+            return sampled[:len(waveforms)]
+
+        with mock.patch.object(ProgramEntry, '_sample_waveforms',
+                               side_effect=sample_waveforms_side_effect) as sample_waveforms:
+            entry = ProgramEntry(loop=self.loop,
+                                 channels=self.channels,
+                                 markers=self.marker,
+                                 amplitudes=self.amplitudes,
+                                 offsets=self.offset,
+                                 voltage_transformations=self.voltage_transformations,
+                                 sample_rate=self.sample_rate,
+                                 waveforms=None)
+            sample_waveforms.assert_not_called()
+
+            self.assertIs(sampled[0], entry.sampled_waveform(self.waveforms[1]))
+            sample_waveforms.assert_called_once_with([self.waveforms[1]])
+            self.assertIs(sampled[0], entry.sampled_waveform(self.waveforms[1]))
+            sample_waveforms.assert_called_once_with([self.waveforms[1]])
+
+            with self.assertRaises(KeyError):
+                entry.sampled_waveform(DummyWaveform(duration=3))
+
+            sample_waveforms.reset_mock()
+            # only the missing waveform is sampled and the order is kept
+            self.assertEqual(OrderedDict([(self.waveforms[0], sampled[0]), (self.waveforms[1], sampled[0])]),
+                             entry._waveforms)
+            sample_waveforms.assert_called_once_with([self.waveforms[0]])
+
+            sample_waveforms.reset_mock()
+            entry._waveforms
+            sample_waveforms.assert_not_called()
+
+    def test_lazy_sampling_error(self):
+        with mock.patch.object(ProgramEntry, '_sample_waveforms', side_effect=KeyError('A')) as sample_waveforms:
+            entry = ProgramEntry(loop=self.loop,
+                                 channels=self.channels,
+                                 markers=self.marker,
+                                 amplitudes=self.amplitudes,
+                                 offsets=self.offset,
+                                 voltage_transformations=self.voltage_transformations,
+                                 sample_rate=self.sample_rate,
+                                 waveforms=None)
+            with self.assertRaises(KeyError):
+                entry._waveforms
+            # the waveforms are still pending so the error is not swallowed by an empty mapping
+            with self.assertRaises(KeyError):
+                entry._waveforms
+            self.assertEqual(2, sample_waveforms.call_count)
+
     def test_sample_waveforms(self):
         empty_ch = np.array([1, 2, 3])
         empty_m = np.array([0, 1, 0])
@@ -98,7 +177,343 @@ class ProgramEntryTests(unittest.TestCase):
                              sample_rate=self.sample_rate,
                              waveforms=[])
 
-        with mock.patch.object(entry, '_sample_empty_channel', return_value=empty_ch):
-            with mock.patch.object(entry, '_sample_empty_marker', return_value=empty_m):
-                sampled = entry._sample_waveforms(self.waveforms)
+        with mock.patch.object(ProgramEntry, '_sample_empty_channel', return_value=empty_ch):
+            with mock.patch.object(ProgramEntry, '_sample_empty_marker', return_value=empty_m):
+                sampled = list(entry._sample_waveforms(self.waveforms))
                 np.testing.assert_equal(expected_sampled, sampled)
+
+    def test_channel_samples(self):
+        entry = ProgramEntry(loop=self.loop,
+                             channels=self.channels,
+                             markers=self.marker,
+                             amplitudes=self.amplitudes,
+                             offsets=self.offset,
+                             voltage_transformations=self.voltage_transformations,
+                             sample_rate=self.sample_rate,
+                             waveforms=None)
+        expected_a = np.concatenate([sampled['A'] for sampled in self.sampled])
+        expected_c = np.concatenate([2. * (sampled['C'] - .1) for sampled in self.sampled])
+        expected_m = np.concatenate([sampled['M'] != 0 for sampled in self.sampled])
+
+        channel_a = entry.channel_samples(0)
+        np.testing.assert_equal(expected_a, channel_a)
+        np.testing.assert_equal(expected_c, entry.channel_samples(2))
+        np.testing.assert_equal(expected_m, entry.marker_samples(1))
+        self.assertIsNone(entry.channel_samples(1))
+        self.assertIsNone(entry.marker_samples(0))
+        # sampled together -> no copy
+        self.assertTrue(np.shares_memory(channel_a, entry._waveforms[self.waveforms[0]][0][0]))
+
+        entry = ProgramEntry(loop=self.loop,
+                             channels=self.channels,
+                             markers=self.marker,
+                             amplitudes=self.amplitudes,
+                             offsets=self.offset,
+                             voltage_transformations=self.voltage_transformations,
+                             sample_rate=self.sample_rate,
+                             waveforms=None)
+        entry.sampled_waveform(self.waveforms[1])
+        np.testing.assert_equal(expected_a, entry.channel_samples(0))
+        np.testing.assert_equal(expected_m, entry.marker_samples(1))
+
+    def test_channel_samples_replaced(self):
+        entry = ProgramEntry(loop=self.loop,
+                             channels=self.channels,
+                             markers=self.marker,
+                             amplitudes=self.amplitudes,
+                             offsets=self.offset,
+                             voltage_transformations=self.voltage_transformations,
+                             sample_rate=self.sample_rate,
+                             waveforms=None)
+        (_, empty, c), markers = entry._waveforms[self.waveforms[1]]
+        # the memory is kept alive by the data of the other waveform
+        replaced = np.zeros(self.sampled[1]['A'].size)
+        entry._waveforms[self.waveforms[1]] = ((replaced, empty, c), markers)
+
+        expected_a = np.concatenate([self.sampled[0]['A'], replaced])
+        np.testing.assert_equal(expected_a, entry.channel_samples(0))
+        self.assertFalse(np.shares_memory(entry.channel_samples(0), c))
+
+        # the unmodified channel is still returned without copy
+        channel_c = entry.channel_samples(2)
+        np.testing.assert_equal(np.concatenate([2. * (sampled['C'] - .1) for sampled in self.sampled]), channel_c)
+        self.assertTrue(np.shares_memory(channel_c, c))
+
+    def test_sample_waveforms_samples_once(self):
+        entry = ProgramEntry(loop=self.loop,
+                             channels=self.channels,
+                             markers=self.marker,
+                             amplitudes=self.amplitudes,
+                             offsets=self.offset,
+                             voltage_transformations=self.voltage_transformations,
+                             sample_rate=self.sample_rate,
+                             waveforms=[])
+        for wf in self.waveforms:
+            wf.sample_calls.clear()
+
+        list(entry._sample_waveforms(self.waveforms))
+
+        for wf in self.waveforms:
+            sampled_channels = [channel for channel, *_ in wf.sample_calls]
+            self.assertEqual(['A', 'C', 'M'], sampled_channels)
+
+    def test_sample_waveforms_cached(self):
+        class CachedProgramEntry(ProgramEntry):
+            __slots__ = ()
+            _sample_cache = base._SampledWaveformCache(max_samples=1000)
+
+        kwargs = dict(loop=self.loop,
+                      channels=self.channels,
+                      markers=self.marker,
+                      offsets=self.offset,
+                      voltage_transformations=self.voltage_transformations,
+                      sample_rate=self.sample_rate,
+                      waveforms=[])
+        entry = CachedProgramEntry(amplitudes=self.amplitudes, **kwargs)
+        expected = list(entry._sample_waveforms(self.waveforms))
+
+        # no cache by default
+        for wf in self.waveforms:
+            wf.sample_calls.clear()
+        entry = ProgramEntry(amplitudes=self.amplitudes, **kwargs)
+        np.testing.assert_equal(expected, list(entry._sample_waveforms(self.waveforms)))
+        for wf in self.waveforms:
+            self.assertEqual(['A', 'C', 'M'], [channel for channel, *_ in wf.sample_calls])
+
+        for wf in self.waveforms:
+            wf.sample_calls.clear()
+
+        entry = CachedProgramEntry(amplitudes=self.amplitudes, **kwargs)
+        sampled = list(entry._sample_waveforms(self.waveforms))
+        np.testing.assert_equal(expected, sampled)
+        for wf in self.waveforms:
+            self.assertEqual([], wf.sample_calls)
+
+        # amplitudes and offsets are applied after the cache
+        entry = CachedProgramEntry(amplitudes=(2., 1., 1.), **kwargs)
+        sampled = list(entry._sample_waveforms(self.waveforms))
+        for (expected_channels, _), (sampled_channels, _) in zip(expected, sampled):
+            np.testing.assert_equal(expected_channels[0] / 2., sampled_channels[0])
+            np.testing.assert_equal(expected_channels[2] / 2., sampled_channels[2])
+        for wf in self.waveforms:
+            self.assertEqual([], wf.sample_calls)
+
+    def test_sample_waveforms_duplicate_channels(self):
+        trafo = mock.Mock(wraps=lambda x: x + 1.)
+        entry = ProgramEntry(loop=self.loop,
+                             channels=('A', 'A', 'C'),
+                             markers=('A', 'M', 'M'),
+                             amplitudes=(1., .5, 1.),
+                             offsets=(0., .5, 0.),
+                             voltage_transformations=(None, trafo, None),
+                             sample_rate=self.sample_rate,
+                             waveforms=[])
+        for wf in self.waveforms:
+            wf.sample_calls.clear()
+
+        sampled = list(entry._sample_waveforms(self.waveforms))
+
+        expected_sampled = [
+            ((expected['A'], 2. * (expected['A'] + 1. - .5), expected['C']),
+             (expected['A'] != 0, expected['M'] != 0, expected['M'] != 0))
+            for expected in self.sampled
+        ]
+        np.testing.assert_equal(expected_sampled, sampled)
+        for wf in self.waveforms:
+            sampled_channels = [channel for channel, *_ in wf.sample_calls]
+            self.assertEqual(['A', 'C', 'M'], sampled_channels)
+
+        # the transformed slot of A comes first
+        entry = ProgramEntry(loop=self.loop,
+                             channels=('A', 'A', 'C'),
+                             markers=(None, 'M', None),
+                             amplitudes=(.5, 1., 1.),
+                             offsets=(.5, 0., 0.),
+                             voltage_transformations=(trafo, None, None),
+                             sample_rate=self.sample_rate,
+                             waveforms=[])
+        for wf in self.waveforms:
+            wf.sample_calls.clear()
+
+        sampled = list(entry._sample_waveforms(self.waveforms))
+        expected_sampled = [
+            ((2. * (expected['A'] + 1. - .5), expected['A'], expected['C']),
+             (None, expected['M'] != 0, None))
+            for expected in self.sampled
+        ]
+        np.testing.assert_equal(expected_sampled, sampled)
+        for wf in self.waveforms:
+            sampled_channels = [channel for channel, *_ in wf.sample_calls]
+            self.assertEqual(['A', 'C', 'M'], sampled_channels)
+
+        # A is only used with transformations and as marker. C is used with a transformation once
+        trafo_2 = mock.Mock(wraps=lambda x: 2. * x)
+        entry = ProgramEntry(loop=self.loop,
+                             channels=('A', 'C', 'A'),
+                             markers=('A', 'M', None),
+                             amplitudes=(1., 1., 1.),
+                             offsets=(0., 0., 0.),
+                             voltage_transformations=(trafo, trafo_2, trafo_2),
+                             sample_rate=self.sample_rate,
+                             waveforms=[])
+        for wf in self.waveforms:
+            wf.sample_calls.clear()
+
+        sampled = list(entry._sample_waveforms(self.waveforms))
+        expected_sampled = [
+            ((expected['A'] + 1., 2. * expected['C'], 2. * expected['A']),
+             (expected['A'] != 0, expected['M'] != 0, None))
+            for expected in self.sampled
+        ]
+        np.testing.assert_equal(expected_sampled, sampled)
+        for wf in self.waveforms:
+            sampled_channels = [channel for channel, *_ in wf.sample_calls]
+            self.assertEqual(['A', 'C', 'M'], sampled_channels)
+
+    def test_sample_waveforms_dtype(self):
+        class Float32ProgramEntry(ProgramEntry):
+            _sample_dtype = np.float32
+
+        entry = Float32ProgramEntry(loop=self.loop,
+                                    channels=self.channels,
+                                    markers=self.marker,
+                                    amplitudes=self.amplitudes,
+                                    offsets=self.offset,
+                                    voltage_transformations=self.voltage_transformations,
+                                    sample_rate=self.sample_rate,
+                                    waveforms=self.waveforms)
+        for wf, expected in zip(self.waveforms, self.sampled):
+            (sampled_a, _, sampled_c), _ = entry._waveforms[wf]
+            self.assertEqual(np.float32, sampled_a.dtype)
+            self.assertEqual(np.float32, sampled_c.dtype)
+            np.testing.assert_allclose(expected['A'], sampled_a, rtol=1e-6, atol=1e-6)
+            np.testing.assert_allclose(2. * (expected['C'] - .1), sampled_c, rtol=1e-6, atol=1e-6)
+
+    def test_sample_waveforms_threaded(self):
+        entry = ProgramEntry(loop=self.loop,
+                             channels=self.channels,
+                             markers=self.marker,
+                             amplitudes=self.amplitudes,
+                             offsets=self.offset,
+                             voltage_transformations=self.voltage_transformations,
+                             sample_rate=self.sample_rate,
+                             waveforms=[])
+        expected = list(entry._sample_waveforms(self.waveforms))
+
+        class ThreadedProgramEntry(ProgramEntry):
+            _sample_workers = 2
+
+        entry = ThreadedProgramEntry(loop=self.loop,
+                                     channels=self.channels,
+                                     markers=self.marker,
+                                     amplitudes=self.amplitudes,
+                                     offsets=self.offset,
+                                     voltage_transformations=self.voltage_transformations,
+                                     sample_rate=self.sample_rate,
+                                     waveforms=[])
+        sampled = list(entry._sample_waveforms(self.waveforms))
+        np.testing.assert_equal(expected, sampled)
+
+    def test_sample_waveforms_affine_transformation(self):
+        trafo = AffineVoltageTransformation(scale=2., offset=.25)
+        entry = ProgramEntry(loop=self.loop,
+                             channels=self.channels,
+                             markers=self.marker,
+                             amplitudes=self.amplitudes,
+                             offsets=self.offset,
+                             voltage_transformations=(AffineVoltageTransformation(), trafo, trafo),
+                             sample_rate=self.sample_rate,
+                             waveforms=[])
+        # folded into offset and amplitude
+        self.assertEqual(((0, 'A', None), (2, 'C', None)), entry._active_channels)
+        self.assertEqual((AffineVoltageTransformation(), trafo, trafo), entry._voltage_transformations)
+
+        sampled = list(entry._sample_waveforms(self.waveforms))
+        for expected, (sampled_channels, _) in zip(self.sampled, sampled):
+            np.testing.assert_equal(expected['A'], sampled_channels[0])
+            np.testing.assert_allclose(2. * (trafo(expected['C']) - .1), sampled_channels[2])
+
+
+class ScratchMemoryPoolTests(unittest.TestCase):
+    def test_acquire_release(self):
+        pool = base._ScratchMemoryPool(max_arrays=2, max_size=100)
+        a = pool.acquire(10)
+        self.assertEqual((10,), a.shape)
+        pool.release(a)
+
+        self.assertIs(a, pool.acquire(5))
+        b = pool.acquire(5)
+        self.assertIsNot(a, b)
+
+        c = np.empty(20)
+        pool.release(a)
+        pool.release(b)
+        pool.release(c)
+        # the smallest array is dropped
+        self.assertIs(c, pool.acquire(15))
+        self.assertIs(a, pool.acquire(10))
+        self.assertEqual((11,), pool.acquire(11).shape)
+
+    def test_best_fit(self):
+        pool = base._ScratchMemoryPool(max_arrays=2, max_size=100)
+        large = np.empty(100)
+        small = np.empty(20)
+        pool.release(large)
+        pool.release(small)
+        self.assertIs(small, pool.acquire(10))
+        self.assertIs(large, pool.acquire(10))
+
+    def test_max_size(self):
+        pool = base._ScratchMemoryPool(max_arrays=2, max_size=100)
+        too_large = pool.acquire(101)
+        self.assertEqual((101,), too_large.shape)
+        pool.release(too_large)
+        self.assertEqual([], pool._free)
+
+        pool.release(np.empty(100))
+        self.assertEqual(1, len(pool._free))
+
+    def test_no_pooling(self):
+        pool = base._ScratchMemoryPool(max_arrays=0, max_size=100)
+        a = pool.acquire(10)
+        pool.release(a)
+        self.assertIsNot(a, pool.acquire(10))
+
+
+class SampleTimesTests(unittest.TestCase):
+    def test_get_sample_times(self):
+        sample_rate = TimeType.from_fraction(12, 10)
+        base._TIME_ARRAY_CACHE.pop(sample_rate, None)
+        wf1 = DummyWaveform(duration=TimeType.from_fraction(20, 12))
+        wf2 = DummyWaveform(duration=TimeType.from_fraction(40, 12))
+
+        expected_times, expected_lengths = get_sample_times([wf1, wf2], sample_rate_in_GHz=sample_rate)
+        times, segment_lengths = base._get_sample_times([wf1, wf2], sample_rate)
+        np.testing.assert_equal(expected_times, times)
+        np.testing.assert_equal(expected_lengths, segment_lengths)
+        self.assertFalse(times.flags.writeable)
+
+        # shorter programs reuse the existing buffer
+        short_times, segment_lengths = base._get_sample_times([wf1], sample_rate)
+        np.testing.assert_equal(expected_times[:2], short_times)
+        np.testing.assert_equal([2], segment_lengths)
+        self.assertTrue(np.shares_memory(times, short_times))
+
+    def test_get_sample_times_long(self):
+        sample_rate = TimeType.from_fraction(12, 10)
+        n_samples = base._TIME_ARRAY_CACHE_SIZE + 1
+        wf = DummyWaveform(duration=TimeType.from_fraction(n_samples * 10, 12))
+
+        expected_times, expected_lengths = get_sample_times([wf], sample_rate_in_GHz=sample_rate)
+        times, segment_lengths = base._get_sample_times([wf], sample_rate)
+        np.testing.assert_equal(expected_times, times)
+        np.testing.assert_equal(expected_lengths, segment_lengths)
+        # long time arrays are not kept alive
+        self.assertFalse(any(np.shares_memory(times, cached) for cached in base._TIME_ARRAY_CACHE.values()))
+
+    def test_get_sample_times_bounded(self):
+        for denominator in range(1, base._TIME_ARRAY_CACHE_MAX_RATES + 3):
+            wf = DummyWaveform(duration=2 * denominator)
+            base._get_sample_times([wf], TimeType.from_fraction(1, denominator))
+        self.assertEqual(base._TIME_ARRAY_CACHE_MAX_RATES, len(base._TIME_ARRAY_CACHE))
+        self.assertNotIn(TimeType.from_fraction(1, 1), base._TIME_ARRAY_CACHE)
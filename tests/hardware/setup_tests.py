@@ -4,6 +4,7 @@ from unittest import mock
 import numpy as np
 
 from qupulse.hardware.setup import HardwareSetup, PlaybackChannel, MarkerChannel, MeasurementMask
+from qupulse.hardware.util import AffineVoltageTransformation
 from qupulse.program.loop import Loop
 
 from tests.pulses.sequencing_dummies import DummyWaveform
@@ -55,6 +56,13 @@ class SingleChannelTests(unittest.TestCase):
         self.assertNotEqual(MarkerChannel(self.awg1, 0),
                             MarkerChannel(self.awg2, 0))
 
+    def test_default_voltage_transformation(self):
+        channel = PlaybackChannel(self.awg1, 0)
+        self.assertEqual(AffineVoltageTransformation(), channel.voltage_transformation)
+
+        voltage = np.linspace(-1, 1, num=11)
+        self.assertIs(voltage, channel.voltage_transformation(voltage))
+
     def test_exceptions(self):
         with self.assertRaises(ValueError):
             MarkerChannel(self.awg1, 2)
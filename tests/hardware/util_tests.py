@@ -9,7 +9,8 @@ except ImportError:
 
 from qupulse.utils.types import TimeType
 from qupulse.hardware.util import voltage_to_uint16, find_positions, get_sample_times, not_none_indices, \
-    zhinst_voltage_to_uint16
+    zhinst_voltage_to_uint16, normalize_samples, _normalize_samples_numba, _normalize_samples_numpy, \
+    AffineVoltageTransformation
 from tests.pulses.sequencing_dummies import DummyWaveform
 
 
@@ -85,6 +86,35 @@ class NotNoneIndexTest(unittest.TestCase):
                          not_none_indices([None, 'a', 'b', None, None, 'c']))
 
 
+class NormalizeSamplesTest(unittest.TestCase):
+    def test_normalize_samples(self):
+        offsets = np.array([[0.], [.5], [-1.]])
+        inv_amplitudes = np.array([[1.], [2.], [.25]])
+        data = np.linspace(-1, 1, num=3 * 20).reshape(3, 20)
+        expected = (data[:, 5:15] - offsets) * inv_amplitudes
+
+        for impl in (normalize_samples, _normalize_samples_numba, _normalize_samples_numpy):
+            samples = data.copy()
+            # normalize a strided view like ProgramEntry does for each segment
+            impl(samples[:, 5:15], offsets, inv_amplitudes)
+            np.testing.assert_allclose(expected, samples[:, 5:15])
+            np.testing.assert_equal(data[:, :5], samples[:, :5])
+            np.testing.assert_equal(data[:, 15:], samples[:, 15:])
+
+
+class AffineVoltageTransformationTest(unittest.TestCase):
+    def test_call(self):
+        voltage = np.linspace(-1, 1, num=11)
+        self.assertIs(voltage, AffineVoltageTransformation()(voltage))
+        np.testing.assert_equal(voltage * 2. + .5, AffineVoltageTransformation(2., .5)(voltage))
+
+    def test_equality(self):
+        self.assertEqual(AffineVoltageTransformation(), AffineVoltageTransformation(1., 0.))
+        self.assertEqual(hash(AffineVoltageTransformation(2., 1.)), hash(AffineVoltageTransformation(2., 1.)))
+        self.assertNotEqual(AffineVoltageTransformation(), AffineVoltageTransformation(2.))
+        self.assertEqual('AffineVoltageTransformation(scale=2.0, offset=0.5)', repr(AffineVoltageTransformation(2., .5)))
+
+
 @unittest.skipIf(zhinst is None, "zhinst not installed")
 class ZHInstVoltageToUint16Test(unittest.TestCase):
     def test_size_exception(self):
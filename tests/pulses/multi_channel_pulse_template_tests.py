@@ -1,4 +1,5 @@
 import unittest
+from types import MappingProxyType
 from unittest import mock
 
 import numpy
@@ -20,22 +21,29 @@ from tests.pulses.pulse_template_tests import PulseTemplateStub
 from tests.serialization_tests import SerializableTests
 
 
+# read-only so no test can modify the channel mappings shared by AtomicMultiChannelPulseTemplateTest
+_CHAN_MAPS = tuple(map(MappingProxyType, ({'c1': 'cc1'}, {'c2': 'cc2'}, {'c3': 'cc3'})))
+
+# measurement windows of MultiChannelPulseTemplateSequencingTests.test_get_measurement_windows in the expected order
+_EXPECTED_MEAS_WINDOWS = [('bar', .1, .2), ('foo', 0, 1), ('bar', .3, .4), ('foo', .1, .2)]
+
+
 class AtomicMultiChannelPulseTemplateTest(unittest.TestCase):
-    def __init__(self,*args,**kwargs):
-        super().__init__(*args,**kwargs)
-
-        self.subtemplates = [DummyPulseTemplate(parameter_names={'p1'},
-                                                measurement_names={'m1'},
-                                                defined_channels={'c1'}),
-                             DummyPulseTemplate(parameter_names={'p2'},
-                                                measurement_names={'m2'},
-                                                defined_channels={'c2'}),
-                             DummyPulseTemplate(parameter_names={'p3'},
-                                                measurement_names={'m3'},
-                                                defined_channels={'c3'})]
-        self.no_param_maps = [{'p1': '1'}, {'p2': '2'}, {'p3': '3'}]
-        self.param_maps = [{'p1': 'pp1'}, {'p2': 'pp2'}, {'p3': 'pp3'}]
-        self.chan_maps = [{'c1': 'cc1'}, {'c2': 'cc2'}, {'c3': 'cc3'}]
+    @classmethod
+    def setUpClass(cls) -> None:
+        # shared between tests. The subtemplates are never used to build waveforms
+        cls.subtemplates = (DummyPulseTemplate(parameter_names={'p1'},
+                                               measurement_names={'m1'},
+                                               defined_channels={'c1'}),
+                            DummyPulseTemplate(parameter_names={'p2'},
+                                               measurement_names={'m2'},
+                                               defined_channels={'c2'}),
+                            DummyPulseTemplate(parameter_names={'p3'},
+                                               measurement_names={'m3'},
+                                               defined_channels={'c3'}))
+        cls.no_param_maps = ({'p1': '1'}, {'p2': '2'}, {'p3': '3'})
+        cls.param_maps = ({'p1': 'pp1'}, {'p2': 'pp2'}, {'p3': 'pp3'})
+        cls._subtemp_args = tuple(zip(cls.subtemplates, cls.param_maps, _CHAN_MAPS))
 
     def test_init_empty(self) -> None:
         with self.assertRaises(ValueError):
@@ -122,33 +130,31 @@ class AtomicMultiChannelPulseTemplateTest(unittest.TestCase):
         self.assertEqual(template.duration, 't1')
 
     def test_mapping_template_pure_conversion(self):
-        template = AtomicMultiChannelPulseTemplate(*zip(self.subtemplates, self.param_maps, self.chan_maps))
+        template = AtomicMultiChannelPulseTemplate(*self._subtemp_args)
 
-        for st, pm, cm in zip(template.subtemplates, self.param_maps, self.chan_maps):
+        for st, pm, cm in zip(template.subtemplates, self.param_maps, _CHAN_MAPS):
             self.assertEqual(st.parameter_names, set(pm.values()))
             self.assertEqual(st.defined_channels, set(cm.values()))
 
     def test_mapping_template_mixed_conversion(self):
         subtemp_args = [
-            (self.subtemplates[0], self.param_maps[0], self.chan_maps[0]),
-            MappingPulseTemplate(self.subtemplates[1], parameter_mapping=self.param_maps[1], channel_mapping=self.chan_maps[1]),
-            (self.subtemplates[2], self.param_maps[2], self.chan_maps[2])
+            (self.subtemplates[0], self.param_maps[0], _CHAN_MAPS[0]),
+            MappingPulseTemplate(self.subtemplates[1], parameter_mapping=self.param_maps[1], channel_mapping=_CHAN_MAPS[1]),
+            (self.subtemplates[2], self.param_maps[2], _CHAN_MAPS[2])
         ]
         template = AtomicMultiChannelPulseTemplate(*subtemp_args)
 
-        for st, pm, cm in zip(template.subtemplates, self.param_maps, self.chan_maps):
+        for st, pm, cm in zip(template.subtemplates, self.param_maps, _CHAN_MAPS):
             self.assertEqual(st.parameter_names, set(pm.values()))
             self.assertEqual(st.defined_channels, set(cm.values()))
 
     def test_channel_intersection(self):
-        chan_maps = self.chan_maps.copy()
-        chan_maps[-1]['c3'] = 'cc1'
+        bad_chan_maps = (_CHAN_MAPS[0], _CHAN_MAPS[1], {'c3': 'cc1'})
         with self.assertRaises(ChannelMappingException):
-            AtomicMultiChannelPulseTemplate(*zip(self.subtemplates, self.param_maps, chan_maps))
+            AtomicMultiChannelPulseTemplate(*zip(self.subtemplates, self.param_maps, bad_chan_maps))
 
     def test_defined_channels(self):
-        subtemp_args = [*zip(self.subtemplates, self.param_maps, self.chan_maps)]
-        template = AtomicMultiChannelPulseTemplate(*subtemp_args)
+        template = AtomicMultiChannelPulseTemplate(*self._subtemp_args)
         self.assertEqual(template.defined_channels, {'cc1', 'cc2', 'cc3'})
 
     def test_measurement_names(self):
@@ -169,7 +175,7 @@ class AtomicMultiChannelPulseTemplateTest(unittest.TestCase):
                          {'a', 'b', 'c', 'd', 'e'})
 
     def test_parameter_names_2(self):
-        template = AtomicMultiChannelPulseTemplate(*zip(self.subtemplates, self.param_maps, self.chan_maps),
+        template = AtomicMultiChannelPulseTemplate(*self._subtemp_args,
                                                    parameter_constraints={'pp1 > hugo'},
                                                    measurements={('meas', 'd', 1)},
                                                    duration='my_duration')
@@ -261,9 +267,8 @@ class MultiChannelPulseTemplateSequencingTests(unittest.TestCase):
         pt = AtomicMultiChannelPulseTemplate(*sts, parameter_constraints=['a < b'], measurements=[('n', .1, .2)])
 
         measurement_mapping = dict(m='foo', n='bar')
-        expected = [('bar', .1, .2), ('foo', 0, 1), ('bar', .3, .4), ('foo', .1, .2)]
         meas_windows = pt.get_measurement_windows({}, measurement_mapping)
-        self.assertEqual(expected, meas_windows)
+        self.assertEqual(_EXPECTED_MEAS_WINDOWS, meas_windows)
 
 
 class AtomicMultiChannelPulseTemplateSerializationTests(SerializableTests, unittest.TestCase):